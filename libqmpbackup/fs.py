@@ -28,33 +28,35 @@ def get_state(qga):
 
 
 def quiesce(qga):
-    """Quiesce VM filesystem"""
-    fsstate = get_state(qga)
-    if fsstate == "frozen":
-        log.warning("Filesystem is already frozen")
-        return True
-
+    """Quiesce VM filesystem, the state is only queried if
+    the freeze fails"""
     try:
         reply = qga.fsfreeze("freeze")
         log.info('"%s" Filesystem(s) freezed', reply)
         return True
     except RuntimeError as errmsg:
+        if get_state(qga) == "frozen":
+            log.warning("Filesystem is already frozen")
+            return True
         log.warning('Unable to freeze: "%s"', errmsg)
 
     return False
 
 
 def thaw(qga):
-    """Thaw filesystems"""
-    fsstate = get_state(qga)
-    if fsstate == "thawed":
-        log.info("Filesystem is already thawed, skipping.")
-        return True
+    """Thaw filesystems, the state is only queried if
+    the thaw fails"""
     try:
         reply = qga.fsfreeze("thaw")
-        log.info('"%s" filesystem(s) thawed', reply)
+        if reply == 0:
+            log.info("Filesystem is already thawed, skipping.")
+        else:
+            log.info('"%s" filesystem(s) thawed', reply)
         return True
     except RuntimeError as errmsg:
+        if get_state(qga) == "thawed":
+            log.info("Filesystem is already thawed, skipping.")
+            return True
         log.warning('Unable to thaw filesystem: "%s"', errmsg)
 
     return False
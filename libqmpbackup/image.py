@@ -12,135 +12,339 @@
  the LICENSE file in the top-level directory.
 """
 import os
-import json
+import re
+import shlex
+import shutil
+import tempfile
+import asyncio
 import logging
 import subprocess
 import datetime
+from functools import lru_cache
 from time import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from libqmpbackup import lib
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 log = logging.getLogger(__name__)
 
+# timestamp within backup file names: <LEVEL>-<timestamp>-<disk>
+_TS_RE = re.compile(r"^[A-Z]+-(\d+)-")
+
+# incremental images without any clusters consist of metadata only
+_TRIVIAL_MAX_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _executable(name):
+    """Return full path of executable, the PATH lookup is done only
+    once per name. Returns None if not found"""
+    return shutil.which(name)
+
+
+def _resolve(cmd):
+    """Return command with its executable resolved to the full path,
+    so the PATH is not searched on each execution"""
+    return [_executable(cmd[0]) or cmd[0]] + cmd[1:]
+
 
-def get_info(filename):
+def _log_cmd(name, cmd, dry_run=False):
+    """Log command line, commands not executed due to dry run are
+    shown at info level"""
+    level = logging.INFO if dry_run else logging.DEBUG
+    if log.isEnabledFor(level):
+        log.log(level, "%s cmd: %s", name, shlex.join(cmd))
+
+
+@lru_cache(maxsize=None)
+def _prlimit():
+    """Return command prefix to limit cpu time and address space of
+    qemu-img info if prlimit is available"""
+    prlimit = _executable("prlimit")
+    if prlimit is None:
+        log.debug("prlimit not found, not limiting qemu-img info resources")
+        return []
+    return [prlimit, "--cpu=30", "--as=1073741824", "--"]
+
+
+def get_info(filename, fmt=None):
     """Query original qemu image information, can be used to re-create
     the image during backup operation with the same options as the
-    original one."""
+    original one. If the image format is passed, qemu-img does not
+    need to probe it."""
+    cmd = _prlimit() + _resolve(["qemu-img", "info", f"{filename}"])
+    if fmt is not None:
+        cmd += ["-f", fmt]
+    cmd += ["--output", "json", "--force-share"]
     try:
-        return subprocess.check_output(
-            ["qemu-img", "info", f"{filename}", "--output", "json", "--force-share"]
-        )
+        return subprocess.check_output(cmd, close_fds=False)
     except subprocess.CalledProcessError as errmsg:
         raise RuntimeError from errmsg
 
 
 def save_info(backupdir, blockdev):
-    """Save qcow image information"""
+    """Save qcow image information, the information for all devices
+    is queried concurrently. Returns the parsed information per device
+    node, so it doesn't have to be read back during image creation"""
+    qcow_configs = {}
+    devices = []
     for dev in blockdev:
-        infofile = os.path.join(backupdir, f"{os.path.basename(dev.filename)}.config")
-
         if dev.driver == "rbd":
             log.info("Skip saving image information for RBD device: [%s]", dev.filename)
             continue
-
-        info = get_info(dev.filename)
-        try:
-            with open(infofile, "wb+") as info_file:
-                info_file.write(info)
+        if dev.format == "raw":
+            log.info("Skip saving image information for raw device: [%s]", dev.filename)
+            continue
+        devices.append(dev)
+
+    if len(devices) == 0:
+        return qcow_configs
+
+    # configs are rewritten below
+    _load_qcow_config.cache_clear()
+
+    with ThreadPoolExecutor(max_workers=min(len(devices), 8)) as executor:
+        futures = {
+            executor.submit(get_info, dev.filename, dev.format): dev for dev in devices
+        }
+        for future in as_completed(futures):
+            dev = futures[future]
+            info = future.result()
+            infofile = os.path.join(
+                backupdir, f"{os.path.basename(dev.filename)}.config"
+            )
+            try:
+                fd = os.open(infofile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    view = memoryview(info)
+                    while view:
+                        view = view[os.write(fd, view) :]
+                finally:
+                    os.close(fd)
                 log.info("Saved image info: [%s]", infofile)
-        except IOError as errmsg:
-            raise RuntimeError(f"Unable to store qcow config: [{errmsg}]") from errmsg
-        except Exception as errmsg:
-            raise RuntimeError(errmsg) from errmsg
+                qcow_configs[dev.node] = json_loads(info)
+            except IOError as errmsg:
+                raise RuntimeError(
+                    f"Unable to store qcow config: [{errmsg}]"
+                ) from errmsg
+            except Exception as errmsg:
+                raise RuntimeError(errmsg) from errmsg
 
+    return qcow_configs
 
-def _get_options_cmd(backupdir, dev):
-    """Read options to apply for backup target image from
-    qcow image info json output"""
+
+@lru_cache(maxsize=None)
+def _load_qcow_config(path):
+    """Read and parse saved qcow image information"""
+    with open(path, "rb") as config_file:
+        return json_loads(config_file.read())
+
+
+@lru_cache(maxsize=None)
+def _options(compat, cluster_size, lazy_refcounts, extended_l2=False):
+    """Build qemu-img create options, devices with identical
+    settings share the result"""
     opt = []
-    with open(
-        os.path.join(backupdir, f"{os.path.basename(dev.filename)}.config"), "rb"
-    ) as config_file:
-        qcow_config = json.loads(config_file.read().decode())
+    if compat is not None:
+        opt += ["-o", f"compat={compat}"]
+    if cluster_size is not None:
+        opt += ["-o", f"cluster_size={cluster_size}"]
+    if lazy_refcounts:
+        opt += ["-o", "lazy_refcounts=on"]
+    if extended_l2:
+        opt += ["-o", "extended_l2=on"]
+    return tuple(opt)
+
+
+def _get_options_cmd(backupdir, dev, qcow_config=None):
+    """Read options to apply for backup target image from
+    qcow image info json output, the saved image information
+    is only read from disk if not passed"""
+    if qcow_config is None:
+        qcow_config = _load_qcow_config(
+            os.path.join(backupdir, f"{os.path.basename(dev.filename)}.config")
+        )
 
+    compat = None
     try:
-        opt.append("-o")
-        opt.append(f"compat={qcow_config['format-specific']['data']['compat']}")
+        compat = qcow_config["format-specific"]["data"]["compat"]
     except KeyError as errmsg:
         log.warning("Unable apply QCOW specific compat option: [%s]", errmsg)
 
+    cluster_size = None
     try:
-        opt.append("-o")
-        opt.append(f"cluster_size={qcow_config['cluster-size']}")
+        cluster_size = qcow_config["cluster-size"]
     except KeyError as errmsg:
         log.warning("Unable apply QCOW specific cluster_size option: [%s]", errmsg)
 
+    lazy_refcounts = False
     try:
-        if qcow_config["format-specific"]["data"]["lazy-refcounts"]:
-            opt.append("-o")
-            opt.append("lazy_refcounts=on")
+        lazy_refcounts = qcow_config["format-specific"]["data"]["lazy-refcounts"]
     except KeyError as errmsg:
         log.warning("Unable apply QCOW specific lazy_refcounts option: [%s]", errmsg)
 
-    return opt
+    # only reported by qemu versions supporting subclusters
+    extended_l2 = (
+        qcow_config.get("format-specific", {}).get("data", {}).get("extended-l2")
+    )
 
+    return list(_options(compat, cluster_size, lazy_refcounts, bool(extended_l2)))
 
-def create(argv, backupdir, blockdev):
+
+def _create_raw(target, size):
+    """Create sparse raw target image, which does not require
+    qemu-img"""
+    try:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+    except OSError as errmsg:
+        raise RuntimeError(
+            f"Unable to create target image [{target}]: {errmsg}"
+        ) from errmsg
+
+
+def _create_one(argv, backupdir, dev, timestamp, qcow_config):
+    """Create target image for a single block device, returns the
+    device node together with the path to the created image"""
+    if argv.no_subdir is True:
+        targetdir = backupdir
+    else:
+        targetdir = os.path.join(backupdir, dev.node)
+    os.makedirs(targetdir, exist_ok=True)
+    if argv.no_timestamp and argv.level in ("copy", "full"):
+        filename = f"{os.path.basename(dev.filename)}.partial"
+    else:
+        filename = (
+            f"{argv.level.upper()}-{timestamp}-{os.path.basename(dev.filename)}.partial"
+        )
+    target = os.path.join(targetdir, filename)
+
+    log.info(
+        "Create target backup image: [%s], virtual size: [%s]",
+        target,
+        dev.virtual_size,
+    )
+    if dev.format == "raw":
+        _create_raw(target, dev.virtual_size)
+        return dev.node, target
+
+    cmd = [
+        "qemu-img",
+        "create",
+        "-f",
+        f"{dev.format}",
+        f"{target}",
+        "-o",
+        f"size={dev.virtual_size}",
+    ]
+    cmd = cmd + _get_options_cmd(backupdir, dev, qcow_config)
+
+    _log_cmd("create", cmd)
+    try:
+        _run(cmd)
+    except RuntimeError as errmsg:
+        raise RuntimeError(
+            f"Unable to create target image [{target}]: {errmsg}"
+        ) from errmsg
+
+    return dev.node, target
+
+
+def create(argv, backupdir, blockdev, qcow_configs=None):
     """Create target image used by qmp blockdev-backup image to dump
     data and returns a list of target images per-device, which will
-    be used as parameter for QMP drive-backup operation"""
-    opt = []
+    be used as parameter for QMP drive-backup operation.
+
+    Images for all devices are created concurrently, as the qemu-img
+    calls are independent of each other. Image information already
+    parsed by save_info() can be passed via qcow_configs."""
+    if qcow_configs is None:
+        qcow_configs = {}
     dev_target = {}
     timestamp = int(time())
-    for dev in blockdev:
-        if argv.no_subdir is True:
-            targetdir = backupdir
-        else:
-            targetdir = os.path.join(backupdir, dev.node)
-        os.makedirs(targetdir, exist_ok=True)
-        if argv.no_timestamp and argv.level in ("copy", "full"):
-            filename = f"{os.path.basename(dev.filename)}.partial"
-        else:
-            filename = f"{argv.level.upper()}-{timestamp}-{os.path.basename(dev.filename)}.partial"
-        target = os.path.join(targetdir, filename)
-        if dev.format != "raw":
-            opt = opt + _get_options_cmd(backupdir, dev)
-
-        cmd = [
-            "qemu-img",
-            "create",
-            "-f",
-            f"{dev.format}",
-            f"{target}",
-            "-o",
-            f"size={dev.virtual_size}",
-        ]
-        if dev.format != "raw":
-            cmd = cmd + opt
-
-        try:
-            log.info(
-                "Create target backup image: [%s], virtual size: [%s]",
-                target,
-                dev.virtual_size,
+    workers = min(len(blockdev), (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _create_one,
+                argv,
+                backupdir,
+                dev,
+                timestamp,
+                qcow_configs.get(dev.node),
             )
-            log.debug(cmd)
-            subprocess.check_output(cmd)
-            dev_target[dev.node] = target
-        except subprocess.CalledProcessError as errmsg:
-            raise RuntimeError from errmsg
+            for dev in blockdev
+        ]
+        for future in as_completed(futures):
+            node, target = future.result()
+            dev_target[node] = target
 
     return dev_target
 
 
-def clone(image, targetfile):
-    """Copy base image for restore into new image file"""
-    if os.path.exists(targetfile):
-        log.error("Target file [%s] already exists, won't overwrite", targetfile)
-        return False
-
+def _convert(image, targetfile, coroutines):
+    """Copy image using qemu-img convert, bypassing the host page
+    cache for both source and target. The qcow specific options of
+    the source image are applied to the target image"""
+    try:
+        info = json_loads(get_info(image))
+    except ValueError as errmsg:
+        raise RuntimeError(
+            f"Unable to parse image information [{image}]: {errmsg}"
+        ) from errmsg
+    convert_cmd = [
+        "qemu-img",
+        "convert",
+        "-O",
+        "qcow2",
+        "-t",
+        "none",
+        "-T",
+        "none",
+    ]
+    if info.get("format") == "qcow2":
+        convert_cmd += _get_options_cmd(None, None, info)
+    if _supports("convert", "-m"):
+        convert_cmd += ["-m", f"{coroutines}"]
+    else:
+        log.warning(
+            "qemu-img convert does not support option -m, "
+            "ignoring --convert-coroutines setting"
+        )
+    convert_cmd += [image, targetfile]
+    _log_cmd("convert", convert_cmd)
+    _run(convert_cmd)
+
+
+def clone(image, targetfile, convert=False, coroutines=8):
+    """Copy base image for restore into new image file. If convert is
+    set, the image is copied using qemu-img convert, falling back to a
+    regular file copy on failure. Convert must only be used for base
+    images: it skips zeroed clusters, which in an incremental image
+    would reveal the data of its backing image after rebase. The
+    number of parallel coroutines used by convert can be set via
+    coroutines."""
     log.info("Copy source image [%s] to image file: [%s]", image, targetfile)
 
+    if convert:
+        if os.path.lexists(targetfile):
+            log.error("Target file [%s] already exists, won't overwrite", targetfile)
+            return False
+        try:
+            _convert(image, targetfile, coroutines)
+            return True
+        except RuntimeError as errmsg:
+            log.warning("Unable to convert image, using file copy: [%s]", errmsg)
+            if os.path.exists(targetfile):
+                os.remove(targetfile)
+
     try:
         lib.copyfile(image, targetfile)
     except RuntimeError as errmsg:
@@ -150,95 +354,346 @@ def clone(image, targetfile):
     return True
 
 
+def _run(cmd, output=False):
+    """Execute command without spawning a shell, returns its output
+    if requested. Raises RuntimeError including the error output of
+    the command on failure"""
+    # file descriptors are created non-inheritable, so the child does
+    # not need to close them, which allows subprocess to use posix_spawn
+    try:
+        return subprocess.run(
+            _resolve(cmd),
+            check=True,
+            stdout=subprocess.PIPE if output else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            close_fds=False,
+        ).stdout
+    except subprocess.CalledProcessError as errmsg:
+        raise RuntimeError(f"{errmsg}: {errmsg.stderr.decode().strip()}") from errmsg
+    except OSError as errmsg:
+        raise RuntimeError(f"Unable to execute {cmd[0]}: {errmsg}") from errmsg
+
+
+async def _run_async(cmd):
+    """Execute command as asyncio subprocess, its output is discarded.
+    The process is killed if the calling task gets cancelled. Raises
+    RuntimeError including the error output of the command on failure"""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *_resolve(cmd),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            close_fds=False,
+        )
+    except OSError as errmsg:
+        raise RuntimeError(f"Unable to execute {cmd[0]}: {errmsg}") from errmsg
+
+    try:
+        _, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+
+    if proc.returncode != 0:
+        errmsg = subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+        raise RuntimeError(f"{errmsg}: {stderr.decode().strip()}") from errmsg
+
+
+@lru_cache(maxsize=None)
+def _qemu_img_caps(subcommand):
+    """Return the options listed in the help output of a qemu-img
+    subcommand, the help is queried only once per subcommand"""
+    try:
+        output = _run(["qemu-img", subcommand, "--help"], output=True)
+    except RuntimeError as errmsg:
+        log.warning(
+            "Unable to query qemu-img %s capabilities: [%s]", subcommand, errmsg
+        )
+        return frozenset()
+
+    return frozenset(re.findall(r"(?<![\w-])--?[a-zA-Z][\w-]*", output.decode()))
+
+
+def _supports(subcommand, option):
+    """Check if qemu-img subcommand supports option"""
+    return option in _qemu_img_caps(subcommand)
+
+
+@lru_cache(maxsize=None)
+def _supports_io_uring():
+    """Check once if qemu-img is able to open files using io_uring. The
+    probe opens an empty temporary file, so the result does not depend
+    on the state of any image to be processed"""
+    with tempfile.NamedTemporaryFile(prefix="qmpbackup-") as probe:
+        spec = f"driver=file,filename={probe.name.replace(',', ',,')},aio=io_uring"
+        try:
+            _run(["qemu-img", "info", "--image-opts", spec])
+        except RuntimeError as errmsg:
+            log.debug("io_uring not supported by qemu-img: %s", errmsg)
+            return False
+
+    log.info("Using io_uring for qemu-img operations")
+    return True
+
+
+def _image_spec(image, dry_run=False):
+    """Return qemu-img arguments for the given qcow2 image. If qemu-img
+    supports io_uring, the image is specified via --image-opts using
+    aio=io_uring for the file protocol. No probe is done during dry
+    run, the image is passed as is then."""
+    if dry_run or not _supports_io_uring():
+        return [image]
+
+    spec = (
+        "driver=qcow2,file.driver=file,"
+        f"file.filename={image.replace(',', ',,')},file.aio=io_uring"
+    )
+    return ["--image-opts", spec]
+
+
 def _check(image):
     """before rebase we check consistency of all files"""
-    check_cmd = f"qemu-img check '{image}'"
+    check_cmd = ["qemu-img", "check", image]
     try:
-        log.info(check_cmd)
-        subprocess.check_output(check_cmd, shell=True)
-    except subprocess.CalledProcessError as errmsg:
+        log.info("Check image consistency: [%s]", image)
+        _log_cmd("check", check_cmd)
+        _run(check_cmd)
+    except RuntimeError as errmsg:
         raise RuntimeError(f"Consistency check failed: {errmsg}") from errmsg
 
 
+async def _check_async(image):
+    """Consistency check for usage within asyncio tasks"""
+    check_cmd = ["qemu-img", "check", image]
+    try:
+        log.info("Check image consistency: [%s]", image)
+        _log_cmd("check", check_cmd)
+        await _run_async(check_cmd)
+    except RuntimeError as errmsg:
+        raise RuntimeError(f"Consistency check failed: {errmsg}") from errmsg
+
+
+@lru_cache(maxsize=None)
+def _is_trivial(image):
+    """Check if an incremental image holds no clusters of its own, the
+    image map is only queried for files small enough to qualify"""
+    if os.path.getsize(image) > _TRIVIAL_MAX_SIZE:
+        return False
+
+    map_cmd = ["qemu-img", "map", "--output=json", "-U", image]
+    try:
+        _log_cmd("map", map_cmd)
+        output = _run(map_cmd, output=True)
+    except RuntimeError as errmsg:
+        log.debug("Unable to map image: %s", errmsg)
+        return False
+
+    try:
+        for extent in json_loads(output):
+            if extent["depth"] > 0:
+                continue
+            # older versions don't report present, assume data then
+            if extent.get("present", extent["data"] or extent["zero"]):
+                return False
+    except (ValueError, KeyError, TypeError) as errmsg:
+        log.debug("Unable to parse image map: %s", errmsg)
+        return False
+
+    return True
+
+
+def _skip_checkpoints(images, sidx):
+    """Return index of the last image to process in chain with
+    regard to the image index selected via --until"""
+    if sidx is None or sidx >= len(images) - 1:
+        return len(images) - 1
+    log.info(
+        "Skipping %s checkpoint(s) after: %s as requested with --until option",
+        len(images) - 1 - sidx,
+        images[sidx],
+    )
+    return sidx
+
+
+def _last_checkpoint(images, until):
+    """Return index of the last image to process, which is the one
+    specified via --until or the latest one"""
+    for idx, image in enumerate(images[1:], start=1):
+        if os.path.basename(image) == until:
+            return idx
+    return len(images) - 1
+
+
+def _check_data(image, skip_check=False):
+    """Consistency check for incremental images, returns False without
+    checking if the image holds no data. If skip_check is set, only
+    the data check is done"""
+    if _is_trivial(image):
+        return False
+    if not skip_check:
+        _check(image)
+    return True
+
+
+def _check_result(argv, image):
+    """Check the base image once after all changes have been committed,
+    if the checks of the incremental images were skipped"""
+    if not argv.skip_check or argv.dry_run:
+        return True
+    try:
+        _check(image)
+    except RuntimeError as errmsg:
+        log.error(errmsg)
+        return False
+    return True
+
+
+def _check_chain(images, skip_check=False):
+    """Check the given incremental images concurrently, returns the data
+    state for each image in chain order. All checks have finished before
+    this returns, so none of them still has an image of the chain open
+    when changes are written"""
+    executor = ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 1) // 2))
+    try:
+        checks = [executor.submit(_check_data, image, skip_check) for image in images]
+        return [check.result() for check in checks]
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
 def _snapshot_exists(snapshot, image):
     """before rebase we check if an snapshot already exists"""
-    check_cmd = f"qemu-img snapshot -l '{image}'"
+    check_cmd = ["qemu-img", "snapshot", "-l", image]
     try:
-        log.info(check_cmd)
-        output = subprocess.check_output(check_cmd, shell=True)
-    except subprocess.CalledProcessError as errmsg:
+        _log_cmd("snapshot list", check_cmd)
+        output = _run(check_cmd, output=True)
+    except RuntimeError as errmsg:
         raise RuntimeError(f"Consistency check failed: {errmsg}") from errmsg
 
-    if snapshot in output.decode():
-        return True
+    return snapshot.encode() in output
+
 
-    return False
+def _validate_chain(images_flat, incremental=True):
+    """Check the image list returned by get_images() before any
+    operation is started on it"""
+    if len(images_flat) == 0:
+        raise RuntimeError("No image files found matching the specified filter.")
+    if incremental and (len(images_flat) == 1 or images_flat[-1].startswith("FULL-")):
+        raise RuntimeError("No incremental images found, nothing to rebase.")
 
 
 def merge(argv):
     """Merge all files into new base image"""
+    return asyncio.run(_merge(argv))
+
+
+async def _merge(argv):
+    """Merge all files into new base image, images required for the
+    merge are copied in the background while they are rebased onto
+    each other, the chain is then committed into the base at once"""
     try:
         images, images_flat = lib.get_images(argv)
+        _validate_chain(images_flat, incremental=False)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
-    idx = len(images) - 1
+    sidx = None
     if argv.until is not None:
         sidx = images_flat.index(argv.until)
 
     targetdir = os.path.dirname(argv.targetfile)
-    if not clone(images[0], argv.targetfile):
+    if not clone(
+        images[0], argv.targetfile, convert=True, coroutines=argv.convert_coroutines
+    ):
         return False
     images[0] = argv.targetfile
+    tgtfiles = [os.path.join(targetdir, os.path.basename(f)) for f in images]
 
-    for image in reversed(images):
-        idx = idx - 1
-        if argv.until is not None and idx >= sidx:
-            log.info("Skipping checkpoint: %s as requested with --until option", image)
-            continue
+    last = _skip_checkpoints(images, sidx)
+
+    chain = []
+    for pos in range(last, -1, -1):
+        image = images[pos]
 
-        if images.index(image) == 0 or argv.targetfile in images[images.index(image)]:
+        if pos == 0 or argv.targetfile in image:
             log.info(
-                "Rollback of latest [FULL]<-[INC] chain complete, ignoring older chains"
+                "Rollback of latest [FULL]<-[INC] chain complete, "
+                "ignoring older chains"
             )
             break
 
-        log.debug('"%s" is based on "%s"', image, images[idx])
+        log.debug('"%s" is based on "%s"', image, images[pos - 1])
+        chain.append(pos)
+    chain.reverse()
 
-        tgtfile = os.path.join(targetdir, os.path.basename(image))
-        if not os.path.exists(tgtfile):
-            if not clone(image, tgtfile):
-                return False
+    semaphore = asyncio.Semaphore(max(2, (os.cpu_count() or 1) // 2))
 
-        tgtfile = os.path.join(targetdir, os.path.basename(images[idx]))
+    async def _clone(image, tgtfile):
+        async with semaphore:
+            return await asyncio.to_thread(clone, image, tgtfile)
+
+    clones = {}
+    for image, tgtfile in zip(images[1 : last + 1], tgtfiles[1 : last + 1]):
         if not os.path.exists(tgtfile):
-            if not clone(images[idx], tgtfile):
-                return False
+            clones[tgtfile] = asyncio.create_task(_clone(image, tgtfile))
 
-        try:
-            rebase_cmd = (
-                "qemu-img rebase -f qcow2 -F qcow2 -b "
-                f'"{targetdir}/{os.path.basename(images[idx])}" '
-                f'"{targetdir}/{os.path.basename(image)}" -u'
-            )
-            log.info(rebase_cmd)
-            subprocess.check_output(rebase_cmd, shell=True)
-            commit_cmd = (
-                "qemu-img commit -b "
-                f'"{targetdir}/{os.path.basename(images[idx])}" '
-                f'"{targetdir}/{os.path.basename(image)}"'
-            )
-            log.info(commit_cmd)
-            subprocess.check_output(commit_cmd, shell=True)
-            if image != argv.targetfile:
-                log.info(
-                    "Removing temporary file after merge: [%s]",
-                    os.path.join(targetdir, os.path.basename(image)),
-                )
-        except subprocess.CalledProcessError as errmsg:
-            log.error("Rebase or commit command failed: [%s]", errmsg)
-            return False
+    async def _rebase_one(pos):
+        tgtfile = tgtfiles[pos]
+        basefile = tgtfiles[pos - 1]
+        for required in (basefile, tgtfile):
+            if required in clones and not await clones[required]:
+                raise RuntimeError(f"Unable to copy image: [{required}]")
+
+        rebase_cmd = [
+            "qemu-img",
+            "rebase",
+            "-f",
+            "qcow2",
+            "-F",
+            "qcow2",
+            "-b",
+            basefile,
+            tgtfile,
+            "-u",
+        ]
+        log.info("rebase %s -> %s", tgtfile, basefile)
+        _log_cmd("rebase", rebase_cmd)
+        async with semaphore:
+            try:
+                await _run_async(rebase_cmd)
+            except RuntimeError as errmsg:
+                raise RuntimeError(f"Rebase command failed: [{errmsg}]") from errmsg
+
+    # the images are stacked onto each other first, so the whole chain
+    # can be committed into the base by a single qemu-img process. The
+    # metadata only rebase steps are independent and run concurrently.
+    rebases = [asyncio.create_task(_rebase_one(pos)) for pos in chain]
+    try:
+        await asyncio.gather(*rebases)
+        if chain:
+            basefile = tgtfiles[0]
+            tgtfile = tgtfiles[chain[-1]]
+            commit_cmd = ["qemu-img", "commit", "-b", basefile] + _image_spec(tgtfile)
+            log.info("commit %s -> %s", tgtfile, basefile)
+            _log_cmd("commit", commit_cmd)
+            try:
+                await _run_async(commit_cmd)
+            except RuntimeError as errmsg:
+                raise RuntimeError(f"Commit command failed: [{errmsg}]") from errmsg
+    except RuntimeError as errmsg:
+        log.error(errmsg)
+        return False
+    finally:
+        tasks = rebases + list(clones.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for pos in chain:
+        if images[pos] != argv.targetfile:
+            log.info("Removing temporary file after merge: [%s]", tgtfiles[pos])
 
     return True
 
@@ -246,6 +701,12 @@ def merge(argv):
 def rebase(argv):
     """Rebase all images in a directory without merging
     the data back into the base image"""
+    return asyncio.run(_rebase(argv))
+
+
+async def _rebase(argv):
+    """Rebase all images in a directory, the consistency checks and
+    rebase steps for all images in chain run concurrently"""
     link = os.path.join(argv.dir, "image")
     if os.path.exists(link):
         log.error("Directory has already been rebased: [%s]", link)
@@ -253,62 +714,83 @@ def rebase(argv):
 
     try:
         images, images_flat = lib.get_images(argv)
+        _validate_chain(images_flat)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
-    if "FULL-" in images[-1]:
-        log.error("No incremental images found, nothing to rebase.")
-        return False
-
-    idx = len(images) - 1
-
-    try:
-        _check(images[0])
-    except RuntimeError as errmsg:
-        log.error(errmsg)
-        return False
+    is_full = [name.startswith("FULL-") for name in images_flat]
 
+    last = len(images) - 1
     if argv.until is not None:
-        sidx = images_flat.index(argv.until)
+        last = _skip_checkpoints(images, images_flat.index(argv.until))
 
-    for image in reversed(images):
-        idx = idx - 1
-        if argv.until is not None and idx >= sidx:
-            log.info("Skipping checkpoint: %s as requested with --until option", image)
-            continue
+    chain = []
+    for pos in range(last, -1, -1):
+        image = images[pos]
 
-        if images.index(image) == 0 or "FULL-" in images[images.index(image)]:
+        if pos == 0 or is_full[pos]:
             log.info(
-                "Rollback of latest [FULL]<-[INC] chain complete, ignoring older chains"
+                "Rollback of latest [FULL]<-[INC] chain complete, "
+                "ignoring older chains"
             )
             log.info("You can use [%s] to access the latest image data.", link)
             break
 
-        log.debug('"%s" is based on "%s"', image, images[idx])
+        log.debug('"%s" is based on "%s"', image, images[pos - 1])
+        chain.append(pos)
 
-        try:
-            _check(image)
-        except RuntimeError as errmsg:
-            log.error(errmsg)
-            return False
+    semaphore = asyncio.Semaphore(max(2, (os.cpu_count() or 1) // 2))
 
-        try:
-            rebase_cmd = (
-                f'qemu-img rebase -f qcow2 -F qcow2 -b "{images[idx]}" "{image}" -u'
-            )
-            log.info(rebase_cmd)
-            if not argv.dry_run:
-                subprocess.check_output(rebase_cmd, shell=True)
-        except subprocess.CalledProcessError as errmsg:
-            log.error("Rebase command failed: [%s]", errmsg)
-            return False
+    async def _check_one(image):
+        async with semaphore:
+            await _check_async(image)
+
+    async def _rebase_one(pos, base_check):
+        await _check_one(images[pos])
+        await base_check
+        rebase_cmd = [
+            "qemu-img",
+            "rebase",
+            "-f",
+            "qcow2",
+            "-F",
+            "qcow2",
+            "-b",
+            images[pos - 1],
+            images[pos],
+            "-u",
+        ]
+        log.info("rebase %s -> %s", images[pos], images[pos - 1])
+        _log_cmd("rebase", rebase_cmd, argv.dry_run)
+        if argv.dry_run:
+            return
+        async with semaphore:
+            try:
+                await _run_async(rebase_cmd)
+            except RuntimeError as errmsg:
+                raise RuntimeError(f"Rebase command failed: [{errmsg}]") from errmsg
+
+    # rebase -u only rewrites the image header, so every image is
+    # rebased as soon as it and the base image passed the check
+    base_check = asyncio.create_task(_check_one(images[0]))
+    tasks = [base_check]
+    tasks += [asyncio.create_task(_rebase_one(pos, base_check)) for pos in chain]
+    try:
+        await asyncio.gather(*tasks)
+    except RuntimeError as errmsg:
+        log.error(errmsg)
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     if not argv.dry_run:
         try:
-            os.symlink(images[-1], "image")
+            os.symlink(os.path.basename(images[-1]), link)
         except OSError as errmsg:
-            logging.warning("Unable to create symlink to latest image: [%s]", errmsg)
+            log.warning("Unable to create symlink to latest image: [%s]", errmsg)
 
     return True
 
@@ -317,59 +799,88 @@ def snapshot_rebase(argv):
     """Rebase the images, commit all changes but create a snapshot
     prior"""
     try:
-        images, _ = lib.get_images(argv)
+        images, images_flat = lib.get_images(argv)
+        _validate_chain(images_flat)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
-    if "FULL-" in images[-1] or len(images) == 1:
-        log.error("No incremental images found, nothing to rebase.")
-        return False
-
+    # consistency checks for all images run concurrently, but have to
+    # pass before the base image is altered by the first snapshot
+    last = _last_checkpoint(images, argv.until)
+    stop_idx = last if os.path.basename(images[last]) == argv.until else None
     try:
         _check(images[0])
+        has_data = _check_chain(images[1 : last + 1], argv.skip_check)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
     if not _snapshot_exists("FULL-BACKUP", images[0]):
-        snapshot_cmd = f'qemu-img snapshot -c "FULL-BACKUP" "{images[0]}"'
-        log.info(snapshot_cmd)
+        snapshot_cmd = ["qemu-img", "snapshot", "-c", "FULL-BACKUP", images[0]]
+        log.info("snapshot %s -> %s", "FULL-BACKUP", images[0])
+        _log_cmd("snapshot", snapshot_cmd, argv.dry_run)
         try:
             if not argv.dry_run:
-                subprocess.check_output(snapshot_cmd, shell=True)
-        except subprocess.CalledProcessError as errmsg:
+                _run(snapshot_cmd)
+        except RuntimeError as errmsg:
             log.error("Rebase command failed: [%s]", errmsg)
             return False
     else:
         log.info("Skip creation of already existent full backup snapshot")
 
-    for image in images[1:]:
-        try:
-            _check(image)
-        except RuntimeError as errmsg:
-            log.error(errmsg)
-            return False
+    for idx, image in enumerate(images[1 : last + 1], start=1):
+        trivial = not has_data[idx - 1]
+        stop = idx == stop_idx
+
+        if trivial:
+            log.info("Image holds no data, skip rebase and commit: [%s]", image)
 
-        timestamp = int(os.path.basename(image).split("-")[1])
-        snapshot_name = datetime.datetime.fromtimestamp(timestamp).strftime(
-            "%Y-%m-%d-%H:%M:%S"
+        match = _TS_RE.match(os.path.basename(image))
+        if match is None:
+            log.error("Unable to get timestamp from file name: [%s]", image)
+            return False
+        dt = datetime.datetime.fromtimestamp(int(match.group(1)))
+        snapshot_name = (
+            f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}-"
+            f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
         )
 
         try:
-            snapshot_cmd = f'qemu-img snapshot -c "{snapshot_name}" "{images[0]}"'
-            log.info(snapshot_cmd)
-            rebase_cmd = (
-                f'qemu-img rebase -f qcow2 -F qcow2 -b "{images[0]}" "{image}" -u'
+            snapshot_cmd = [
+                "qemu-img",
+                "snapshot",
+                "-c",
+                snapshot_name,
+                images[0],
+            ]
+            log.info("snapshot %s -> %s", snapshot_name, images[0])
+            _log_cmd("snapshot", snapshot_cmd, argv.dry_run)
+            rebase_cmd = [
+                "qemu-img",
+                "rebase",
+                "-f",
+                "qcow2",
+                "-F",
+                "qcow2",
+                "-b",
+                images[0],
+                image,
+                "-u",
+            ]
+            log.info("rebase %s -> %s", image, images[0])
+            _log_cmd("rebase", rebase_cmd, argv.dry_run)
+            commit_cmd = ["qemu-img", "commit", "-b", images[0]] + _image_spec(
+                image, argv.dry_run
             )
-            log.info(rebase_cmd)
-            commit_cmd = "qemu-img commit -b " f'"{images[0]}" ' f'"{image}"'
-            log.info(commit_cmd)
+            log.info("commit %s -> %s", image, images[0])
+            _log_cmd("commit", commit_cmd, argv.dry_run)
             if not argv.dry_run:
-                subprocess.check_output(rebase_cmd, shell=True)
-                subprocess.check_output(commit_cmd, shell=True)
-                subprocess.check_output(snapshot_cmd, shell=True)
-        except subprocess.CalledProcessError as errmsg:
+                if not trivial:
+                    _run(rebase_cmd)
+                    _run(commit_cmd)
+                _run(snapshot_cmd)
+        except RuntimeError as errmsg:
             log.error("Rebase command failed: [%s]", errmsg)
             return False
 
@@ -377,62 +888,93 @@ def snapshot_rebase(argv):
             log.info("Removing: [%s]", image)
             os.remove(image)
 
-        if argv.until is not None and os.path.basename(image) == argv.until:
+        if stop:
             log.info(
-                "Stopping at checkpoint: %s as requested with --until option", image
+                "Stopping at checkpoint: %s as requested with --until option",
+                image,
             )
             break
 
-    return True
+    return _check_result(argv, images[0])
 
 
 def commit(argv):
-    """Rebase and commit all changes"""
+    """Rebase and commit all changes, the images are stacked onto each
+    other and committed into the base image by a single qemu-img call"""
     try:
-        images, _ = lib.get_images(argv)
+        images, images_flat = lib.get_images(argv)
+        _validate_chain(images_flat)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
-    if "FULL-" in images[-1] or len(images) == 1:
-        log.error("No incremental images found, nothing to rebase.")
-        return False
-
+    # consistency checks for all images run concurrently, but have to
+    # pass before any image of the chain is altered
+    last = _last_checkpoint(images, argv.until)
+    stop_idx = last if os.path.basename(images[last]) == argv.until else None
     try:
         _check(images[0])
+        has_data = _check_chain(images[1 : last + 1], argv.skip_check)
     except RuntimeError as errmsg:
         log.error(errmsg)
         return False
 
-    for image in images[1:]:
-        try:
-            _check(image)
-        except RuntimeError as errmsg:
-            log.error(errmsg)
-            return False
+    base = images[0]
+    top = None
+    chain = []
+    for idx, image in enumerate(images[1 : last + 1], start=1):
+        chain.append(image)
+        stop = idx == stop_idx
 
+        if not has_data[idx - 1]:
+            log.info("Image holds no data, skip rebase: [%s]", image)
+        else:
+            try:
+                rebase_cmd = [
+                    "qemu-img",
+                    "rebase",
+                    "-f",
+                    "qcow2",
+                    "-F",
+                    "qcow2",
+                    "-b",
+                    base,
+                    image,
+                    "-u",
+                ]
+                log.info("rebase %s -> %s", image, base)
+                _log_cmd("rebase", rebase_cmd, argv.dry_run)
+                if not argv.dry_run:
+                    _run(rebase_cmd)
+            except RuntimeError as errmsg:
+                log.error("Rebase command failed: [%s]", errmsg)
+                return False
+            base = image
+            top = image
+
+        if stop:
+            log.info(
+                "Stopping at checkpoint: %s as requested with --until option",
+                image,
+            )
+            break
+
+    if top is not None:
         try:
-            rebase_cmd = (
-                f'qemu-img rebase -f qcow2 -F qcow2 -b "{images[0]}" "{image}" -u'
+            commit_cmd = ["qemu-img", "commit", "-b", images[0]] + _image_spec(
+                top, argv.dry_run
             )
-            log.info(rebase_cmd)
-            commit_cmd = f"qemu-img commit '{image}'"
-            log.info(commit_cmd)
+            log.info("commit %s -> %s", top, images[0])
+            _log_cmd("commit", commit_cmd, argv.dry_run)
             if not argv.dry_run:
-                subprocess.check_output(rebase_cmd, shell=True)
-                subprocess.check_output(commit_cmd, shell=True)
-        except subprocess.CalledProcessError as errmsg:
-            log.error("Rebase command failed: [%s]", errmsg)
+                _run(commit_cmd)
+        except RuntimeError as errmsg:
+            log.error("Commit command failed: [%s]", errmsg)
             return False
 
+    for image in chain:
         if not argv.dry_run:
             log.info("Removing: [%s]", image)
             os.remove(image)
 
-        if argv.until is not None and os.path.basename(image) == argv.until:
-            log.info(
-                "Stopping at checkpoint: %s as requested with --until option", image
-            )
-            break
-
-    return True
+    return _check_result(argv, images[0])
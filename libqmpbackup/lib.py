@@ -13,10 +13,12 @@
 """
 import os
 import sys
+import queue
+import atexit
+import fcntl
 import shutil
 import uuid
-from json import dumps as json_dumps
-from glob import glob
+from json import JSONEncoder
 import logging
 import logging.handlers
 import colorlog
@@ -24,22 +26,49 @@ from libqmpbackup.qaclient import QemuGuestAgentClient
 
 log = logging.getLogger(__name__)
 
+_json_pp_encoder = JSONEncoder(indent=4, sort_keys=True)
+
+# ioctl request to share file extents, see linux/fs.h
+FICLONE = 0x40049409
+
+# passes the queued log records to the handlers, see setup_log()
+_log_listener = None
+
+
+def _any_entry(directory, prefix=None, suffix=None):
+    """Check if directory contains an entry whose name starts with
+    prefix or ends with suffix, stops at the first match"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if prefix is not None and entry.name.startswith(prefix):
+                    return True
+                if suffix is not None and entry.name.endswith(suffix):
+                    return True
+    except FileNotFoundError:
+        pass
+
+    return False
+
 
 def has_full(directory, filename):
     """Check if directory contains full backup, either by searching
     for files beginning with FULL* or the file name of the disk
     itself (if --no-symlink/--no-subdir is used)
     """
-    if len(glob(f"{directory}/FULL*")) == 0 and not os.path.exists(
-        os.path.join(directory, os.path.basename(filename))
-    ):
-        return False
+    # probing the disk file name is cheaper than scanning the directory
+    if os.path.exists(os.path.join(directory, os.path.basename(filename))):
+        return True
 
-    return True
+    return _any_entry(directory, prefix="FULL")
 
 
 def setup_log(argv):
-    """setup logging"""
+    """setup logging, logging is only configured once"""
+    global _log_listener  # pylint: disable=global-statement
+    if logging.getLogger().hasHandlers():
+        return logging.getLogger(__name__)
+
     log_format_colored = (
         "%(green)s[%(asctime)s]%(reset)s%(blue)s %(log_color)s%(levelname)7s%(reset)s "
         "- %(funcName)s"
@@ -67,25 +96,45 @@ def setup_log(argv):
         handler.append(logging.handlers.SysLogHandler(address="/dev/log"))
     if argv.logfile != "":
         logpath = os.path.dirname(argv.logfile)
-        if logpath != "":
+        if logpath != "" and not os.path.isdir(logpath):
             os.makedirs(logpath, exist_ok=True)
-        handler.append(logging.FileHandler(argv.logfile, mode="a"))
-    logging.basicConfig(format=log_format, level=loglevel, handlers=handler)
+        handler.append(logging.FileHandler(argv.logfile, mode="a", delay=True))
+    for hdl in handler[1:]:
+        hdl.setFormatter(logging.Formatter(log_format))
+
+    # records are passed to the handlers by a separate thread, so
+    # writing log messages does not block the backup operation.
+    # The queue handler only merges the message arguments, the
+    # handlers apply the formatting.
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, *handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    atexit.register(stop_log)
+    logging.basicConfig(level=loglevel, handlers=[queue_handler])
     return logging.getLogger(__name__)
 
 
+def stop_log():
+    """Stop the log listener thread, all queued records are passed to
+    the handlers before it returns. Should be called before exiting"""
+    global _log_listener  # pylint: disable=global-statement
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
 def json_pp(json):
     """human readable json output"""
-    return json_dumps(json, indent=4, sort_keys=True)
+    return _json_pp_encoder.encode(json)
 
 
 def has_partial(backupdir):
     """Check if partial backup exists in target directory"""
-    if os.path.exists(backupdir):
-        if len(glob(f"{backupdir}/*.partial")) > 0:
-            return True
-
-    return False
+    return _any_entry(backupdir, suffix=".partial")
 
 
 def check_bitmap_uuid(bitmaps, backup_uuid):
@@ -106,14 +155,19 @@ def check_bitmap_state(node, bitmaps):
     disabled-> migration might be going on
     """
     status = False
+    debug = log.isEnabledFor(logging.DEBUG)
+    match = f"qmpbackup-{node}"
     for bitmap in bitmaps:
-        log.debug("Bitmap information: %s", json_pp(bitmap))
-        try:
-            status = "active" in bitmap["status"]
-        except KeyError:
-            status = bitmap["recording"]
-
-        if bitmap["name"] == f"qmpbackup-{node}" and status is True:
+        if debug:
+            log.debug("Bitmap information: %s", json_pp(bitmap))
+        # newer qemu versions report the recording state only
+        state = bitmap.get("status")
+        if state is not None:
+            status = "active" in state
+        else:
+            status = bitmap.get("recording", False)
+
+        if bitmap["name"] == match and status is True:
             return True
 
     return status
@@ -128,12 +182,14 @@ def connect_qaagent(socket):
         log.warning('Unable to connect guest agent socket: "%s"', errmsg)
         return False
 
-    log.info("Trying to ping guest agent")
-    if not qga.ping(5):
+    # a reply to the info request already proves the agent is alive,
+    # no separate ping round trip is required
+    log.info("Trying to reach guest agent")
+    qga_info = qga.info(5)
+    if qga_info is None:
         log.warning("Unable to reach Guest Agent: can't freeze file systems.")
         return False
 
-    qga_info = qga.info()
     log.info("Guest Agent is reachable")
     if "guest-fsfreeze-freeze" not in qga_info:
         log.warning("Guest agent does not support required commands.")
@@ -144,48 +200,107 @@ def connect_qaagent(socket):
 
 def get_images(argv):
     """get images within backup folder"""
-    os.chdir(argv.dir)
-    image_files = filter(os.path.isfile, os.listdir(argv.dir))
-    images = [
-        os.path.join(argv.dir, f)
-        for f in image_files
-        if not (f.endswith(".config") or f == "uuid")
-    ]
-    images_flat = [os.path.basename(f) for f in images]
+    # scandir results already tell if an entry is a file, so each image
+    # is stat()ed only once for its modification time
+    with os.scandir(argv.dir) as entries:
+        image_files = [
+            (entry.stat().st_mtime, entry.name)
+            for entry in entries
+            if entry.is_file()
+            and not (
+                entry.name.endswith(".config") or entry.name in ("uuid", "uuid.tmp")
+            )
+        ]
+
+    # sort files by creation date, use the file name as tie breaker
+    image_files.sort()
+    images_flat = [name for _, name in image_files]
     if argv.until is not None and argv.until not in images_flat:
         raise RuntimeError(
             "Image file specified by --until option "
             f"[{argv.until}] does not exist in backup directory"
         )
 
-    # sort files by creation date
-    images.sort(key=os.path.getmtime)
-    images_flat.sort(key=os.path.getmtime)
-
-    if len(images) == 0:
+    if len(images_flat) == 0:
         raise RuntimeError("No image files found in specified directory")
 
-    if ".partial" in " ".join(images_flat):
+    if any(f.endswith(".partial") for f in images_flat):
         raise RuntimeError(
             "Partial backup file found, backup chain might be broken. "
             "Consider removing file before attempting to rebase."
         )
     if argv.filter == "":
-        if "FULL-" not in images[0]:
+        if not images_flat[0].startswith("FULL-"):
             raise RuntimeError("Unable to find base FULL image in target folder.")
 
     if argv.filter != "":
-        images = [x for x in images if argv.filter in x]
-        images_flat = [x for x in images_flat if argv.filter in x]
+        images_flat = [name for name in images_flat if argv.filter in name]
+
+    directory = os.path.abspath(argv.dir)
+    images = [os.path.join(directory, name) for name in images_flat]
 
     return images, images_flat
 
 
-def copyfile(src, target):
-    """Copy file"""
+def _reflink(src, target):
+    """Share the data extents of source with target file on
+    copy-on-write filesystems like btrfs or xfs"""
+    try:
+        fcntl.ioctl(target.fileno(), FICLONE, src.fileno())
+    except OSError as errmsg:
+        log.debug("Unable to reflink file: [%s]", errmsg)
+        return False
+
+    return True
+
+
+def _copy_range(src, target):
+    """Copy file data within the kernel, returns False if the copy
+    has to be completed by other means. File offsets of both files
+    are advanced by the amount of data copied."""
+    if not hasattr(os, "copy_file_range"):
+        return False
+    while True:
+        try:
+            copied = os.copy_file_range(src.fileno(), target.fileno(), 1 << 30)
+        except OSError as errmsg:
+            log.debug("Unable to copy file range: [%s]", errmsg)
+            return False
+        if copied == 0:
+            return True
+
+
+def _sendfile(src, target):
+    """Copy file data using sendfile, returns False if the copy has to
+    be completed by other means"""
+    while True:
+        try:
+            copied = os.sendfile(target.fileno(), src.fileno(), None, 1 << 30)
+        except OSError as errmsg:
+            log.debug("Unable to sendfile: [%s]", errmsg)
+            return False
+        if copied == 0:
+            return True
+
+
+def copyfile(src, target, buffer_size=1024 * 1024):
+    """Copy file, a reflink is attempted first, then an in kernel
+    copy. If neither is supported the data is copied using reads
+    and writes of buffer_size. Existing target files are never
+    overwritten."""
     try:
-        shutil.copyfile(src, target)
-    except shutil.Error as errmsg:
+        with open(src, "rb") as fsrc, open(target, "xb") as fdst:
+            if _reflink(fsrc, fdst):
+                log.info("Created reflink copy of [%s]", src)
+                return
+            if _copy_range(fsrc, fdst) or _sendfile(fsrc, fdst):
+                return
+            shutil.copyfileobj(fsrc, fdst, buffer_size)
+    except FileExistsError as errmsg:
+        raise RuntimeError(
+            f"Target file [{target}] already exists, won't overwrite"
+        ) from errmsg
+    except OSError as errmsg:
         raise RuntimeError(
             f"Failed to copy file [{src}] to [{target}]: {errmsg}"
         ) from errmsg
@@ -200,10 +315,21 @@ def save_uuid(target, use_uuid=""):
         backup_uuid = uuid.uuid4()
     else:
         backup_uuid = use_uuid
+    # write to temporary file and rename, so the uuid file is never
+    # found empty or truncated after a crash
+    tmpfile = f"{uuidfile}.tmp"
     try:
-        with open(uuidfile, "w+", encoding="utf-8") as info_file:
+        with open(tmpfile, "w", encoding="utf-8") as info_file:
             info_file.write(str(backup_uuid))
-            log.info("Backup UUID: [%s]", backup_uuid)
+            info_file.flush()
+            os.fsync(info_file.fileno())
+        os.replace(tmpfile, uuidfile)
+        dirfd = os.open(target, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+        log.info("Backup UUID: [%s]", backup_uuid)
     except IOError as errmsg:
         raise RuntimeError(f"Unable to store uuid: [{errmsg}]") from errmsg
     except Exception as errmsg:
@@ -217,13 +343,17 @@ def get_uuid(target):
     backup target folder during incremental backup"""
     uuidfile = os.path.join(target, "uuid")
     try:
-        with open(uuidfile, "r", encoding="utf-8") as uuid_file:
-            backup_uuid = uuid_file.read()
-            log.info(
-                "Current Backup UUID: [%s] for folder [%s]",
-                backup_uuid,
-                target,
-            )
+        # the file holds a single uuid only, no buffered reader required
+        fd = os.open(uuidfile, os.O_RDONLY)
+        try:
+            backup_uuid = os.read(fd, 4096).decode("utf-8").strip()
+        finally:
+            os.close(fd)
+        log.info(
+            "Current Backup UUID: [%s] for folder [%s]",
+            backup_uuid,
+            target,
+        )
     except IOError as errmsg:
         raise RuntimeError(f"Failed to read file [{uuidfile}]") from errmsg
     except Exception as errmsg:
@@ -19,6 +19,16 @@ import json
 import errno
 import socket
 
+try:
+    from orjson import dumps as json_dumps
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+    def json_dumps(obj):
+        """Serialize object to bytes, as orjson does"""
+        return json.dumps(obj).encode()
+
 
 class QMPError(Exception):
     """Error Exception"""
@@ -57,12 +67,10 @@ class QEMUMonitorProtocol:
 
     def __json_read(self):
         """Read reply"""
-        while True:
-            data = self.__sockfile.readline()
-            if not data:
-                return None
-            resp = json.loads(data)
-            return resp
+        data = self.__sockfile.readline()
+        if not data:
+            return None
+        return json_loads(data)
 
     error = socket.error
 
@@ -76,7 +84,9 @@ class QEMUMonitorProtocol:
         @raise QMPCapabilitiesError if fails to negotiate capabilities
         """
         self.__sock.connect(self.__address)
-        self.__sockfile = self.__sock.makefile()
+        # replies are read line by line, use a large buffer so big
+        # replies don't result in many small reads
+        self.__sockfile = self.__sock.makefile("rb", buffering=65536)
 
     def cmd_obj(self, qmp_cmd):
         """
@@ -87,7 +97,7 @@ class QEMUMonitorProtocol:
                 been closed
         """
         try:
-            self.__sock.sendall(json.dumps(qmp_cmd).encode())
+            self.__sock.sendall(json_dumps(qmp_cmd))
         except OSError as err:
             if err.errno == errno.EPIPE:
                 return err
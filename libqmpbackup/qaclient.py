@@ -17,9 +17,14 @@ class QemuGuestAgent(qmp.QEMUMonitorProtocol):
     """Wrap functions"""
 
     def __getattr__(self, name):
+        # only called for unknown attributes: the wrapper is stored
+        # as instance attribute, so it is created only once per command
+        cmd = "guest-" + name.replace("_", "-")
+
         def wrapper(**kwds):
-            return self.command("guest-" + name.replace("_", "-"), **kwds)
+            return self.command(cmd, **kwds)
 
+        setattr(self, name, wrapper)
         return wrapper
 
 
@@ -42,9 +47,15 @@ class QemuGuestAgentClient:
             if isinstance(ret, int) and int(ret) == uid:
                 break
 
-    def info(self):
-        """Return supported commands"""
-        info = self.qga.info()
+    def info(self, timeout=None):
+        """Return supported commands, None if the agent does not
+        reply within timeout"""
+        if timeout is not None:
+            self.qga.settimeout(timeout)
+        try:
+            info = self.qga.info()
+        except self.qga.timeout:
+            return None
         return [c["name"] for c in info["supported_commands"] if c["enabled"]]
 
     def ping(self, timeout):
@@ -10,7 +10,6 @@
 """
 import os
 import logging
-from time import sleep
 import asyncio
 from qemu.qmp import EventListener, qmp_client
 from libqmpbackup import fs
@@ -54,11 +53,10 @@ class QmpCommon:
 
     @staticmethod
     def transaction_action(action, **kwargs):
-        """Return transaction action object"""
-        return {
-            "type": action,
-            "data": dict((k.replace("_", "-"), v) for k, v in kwargs.items()),
-        }
+        """Return transaction action object, the keyword arguments
+        are used as action data as is, so keys containing a dash
+        must be passed via dict unpacking"""
+        return {"type": action, "data": kwargs}
 
     def transaction_bitmap_clear(self, node, name, **kwargs):
         """Return transaction action object for bitmap clear"""
@@ -72,36 +70,43 @@ class QmpCommon:
             "block-dirty-bitmap-add", node=node, name=name, **kwargs
         )
 
+    async def execute_all(self, cmd, arguments):
+        """Execute command for each set of arguments, the commands are
+        sent without waiting for the previous reply. All commands are
+        finished before the first error is raised"""
+        results = await asyncio.gather(
+            *[self.qmp.execute(cmd, arguments=args) for args in arguments],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
     async def prepare_target_devices(self, devices, target_files):
         """Create the required target devices for blockev-backup
         operation"""
         self.log.info("Attach backup target devices to virtual machine")
-        for device in devices:
-            target = target_files[device.node]
-            targetdev = f"qmpbackup-{device.node}"
-
-            await self.qmp.execute(
-                "blockdev-add",
-                arguments={
+        await self.execute_all(
+            "blockdev-add",
+            [
+                {
                     "driver": device.format,
-                    "node-name": targetdev,
-                    "file": {"driver": "file", "filename": target},
-                },
-            )
+                    "node-name": f"qmpbackup-{device.node}",
+                    "file": {"driver": "file", "filename": target_files[device.node]},
+                }
+                for device in devices
+            ],
+        )
 
     async def remove_target_devices(self, devices):
         """Cleanup named devices after executing blockdev-backup
         operation"""
         self.log.info("Removing backup target devices from virtual machine")
-        for device in devices:
-            targetdev = f"qmpbackup-{device.node}"
-
-            await self.qmp.execute(
-                "blockdev-del",
-                arguments={
-                    "node-name": targetdev,
-                },
-            )
+        await self.execute_all(
+            "blockdev-del",
+            [{"node-name": f"qmpbackup-{device.node}"} for device in devices],
+        )
 
     def prepare_transaction(self, argv, devices, uuid):
         """Prepare transaction steps"""
@@ -118,9 +123,11 @@ class QmpCommon:
 
         actions = []
         for device in devices:
-            targetdev = f"qmpbackup-{device.node}"
-            bitmap = f"{bitmap_prefix}-{device.node}-{uuid}"
-            job_id = f"qmpbackup.{device.node}.{os.path.basename(device.filename)}"
+            node = device.node
+            filename = os.path.basename(device.filename)
+            targetdev = f"qmpbackup-{node}"
+            bitmap = f"{bitmap_prefix}-{node}-{uuid}"
+            job_id = f"qmpbackup.{node}.{filename}"
 
             if (
                 not device.has_bitmap
@@ -129,28 +136,24 @@ class QmpCommon:
                 or device.has_bitmap
                 and argv.level in ("copy")
             ):
-                self.log.info(
-                    "Creating new bitmap: [%s] for device [%s]", bitmap, device.node
-                )
+                self.log.info("Creating new bitmap: [%s] for device [%s]", bitmap, node)
                 actions.append(
-                    self.transaction_bitmap_add(
-                        device.node, bitmap, persistent=persistent
-                    )
+                    self.transaction_bitmap_add(node, bitmap, persistent=persistent)
                 )
 
             if device.has_bitmap and argv.level in ("full") and device.format != "raw":
                 self.log.info(
                     "Clearing existing bitmap [%s] for device: [%s:%s]",
                     bitmap,
-                    device.node,
-                    os.path.basename(device.filename),
+                    node,
+                    filename,
                 )
-                actions.append(self.transaction_bitmap_clear(device.node, bitmap))
+                actions.append(self.transaction_bitmap_clear(node, bitmap))
 
             compress = argv.compress
             if device.format == "raw" and compress:
                 compress = False
-                self.log.info("Disabling compression for raw device: [%s]", device.node)
+                self.log.info("Disabling compression for raw device: [%s]", node)
 
             if argv.level in ("full", "copy") or (
                 argv.level == "inc" and device.format == "raw"
@@ -158,10 +161,10 @@ class QmpCommon:
                 actions.append(
                     self.transaction_action(
                         "blockdev-backup",
-                        device=device.node,
+                        device=node,
                         target=targetdev,
                         sync="full",
-                        job_id=job_id,
+                        **{"job-id": job_id},
                         speed=argv.speed_limit,
                         compress=compress,
                     )
@@ -171,10 +174,10 @@ class QmpCommon:
                     self.transaction_action(
                         "blockdev-backup",
                         bitmap=bitmap,
-                        device=device.node,
+                        device=node,
                         target=targetdev,
                         sync=sync,
-                        job_id=job_id,
+                        **{"job-id": job_id},
                         speed=argv.speed_limit,
                         compress=argv.compress,
                     )
@@ -214,21 +217,27 @@ class QmpCommon:
         actions = self.prepare_transaction(argv, devices, uuid)
         with self.qmp.listen(listener):
             await self.qmp.execute("transaction", arguments={"actions": actions})
-            _ = asyncio.create_task(self.progress(), name="progress")
-            if qga is not False:
-                fs.thaw(qga)
-            async for event in listener:
-                if event["event"] in ("BLOCK_JOB_CANCELLED", "BLOCK_JOB_ERROR"):
-                    raise RuntimeError(
-                        "Block job failed for device "
-                        f"[{event['data']['device']}]: [{event['event']}]",
-                    )
-                if event["event"] == "BLOCK_JOB_COMPLETED":
-                    finished += 1
-                    self.log.info("Block job [%s] finished", event["data"]["device"])
-                if len(devices) == finished:
-                    self.log.info("All backups finished")
-                    break
+            progress = asyncio.create_task(self.progress(), name="progress")
+            try:
+                if qga is not False:
+                    fs.thaw(qga)
+                async for event in listener:
+                    if event["event"] in ("BLOCK_JOB_CANCELLED", "BLOCK_JOB_ERROR"):
+                        raise RuntimeError(
+                            "Block job failed for device "
+                            f"[{event['data']['device']}]: [{event['event']}]",
+                        )
+                    if event["event"] == "BLOCK_JOB_COMPLETED":
+                        finished += 1
+                        self.log.info(
+                            "Block job [%s] finished", event["data"]["device"]
+                        )
+                    if len(devices) == finished:
+                        self.log.info("All backups finished")
+                        break
+            finally:
+                progress.cancel()
+                await asyncio.gather(progress, return_exceptions=True)
 
     async def do_query_block(self):
         """Return list of attached block devices"""
@@ -236,6 +245,7 @@ class QmpCommon:
 
     async def remove_bitmaps(self, blockdev, prefix="qmpbackup", uuid=""):
         """Remove existing bitmaps for block devices"""
+        remove = []
         for dev in blockdev:
             if not dev.has_bitmap:
                 self.log.info("No bitmap set for device %s", dev.node)
@@ -259,15 +269,14 @@ class QmpCommon:
                     )
                     continue
                 self.log.info("Removing bitmap: %s", bitmap_name)
-                await self.qmp.execute(
-                    "block-dirty-bitmap-remove",
-                    arguments={"node": dev.node, "name": bitmap_name},
-                )
+                remove.append({"node": dev.node, "name": bitmap_name})
+
+        await self.execute_all("block-dirty-bitmap-remove", remove)
 
     async def progress(self):
         """Report progress for active block job"""
         while True:
-            sleep(1)
+            await asyncio.sleep(1)
             try:
                 jobs = await self.qmp.execute("query-block-jobs")
             except qmp_client.ExecInterruptedError:
@@ -279,17 +288,13 @@ class QmpCommon:
                     continue
                 if job["status"] != "running":
                     continue
-                prog = [
-                    (
-                        round(job["offset"] / job["len"] * 100)
-                        if job["offset"] != 0
-                        else 0
-                    )
-                ]
+                offset = job["offset"]
+                total = job["len"]
+                prog = round(offset / total * 100) if offset != 0 else 0
                 self.log.info(
                     "[%s] Wrote Offset: %s%% (%s of %s)",
                     job["device"],
-                    prog[0],
-                    job["offset"],
-                    job["len"],
+                    prog,
+                    offset,
+                    total,
                 )